@@ -1,16 +1,31 @@
-import os
-import hmac
-import hashlib
+# gevent 必須在 requests、ssl 等模組載入前 patch，等待露天回應時才會讓出給其他請求
+from gevent import monkey
+monkey.patch_all()
+
+import functools
+import logging
+import ssl
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import orjson
 import requests
-from urllib.parse import urlencode
-from flask import Flask, request, jsonify
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
 
 # 從 .env 文件載入環境變數 (本地測試用)
 load_dotenv()
 
+# signer 在 import 時讀取金鑰，必須在 load_dotenv() 之後
+from signer import PRODUCT_LIST_ENDPOINT, build_signed_request, is_valid_endpoint
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 
 # **== 部署到網站的最終設定 ==**
@@ -19,110 +34,310 @@ app = Flask(__name__)
 # 例如： origins = ["https://www.my-cool-shop.com", "https://my-cool-shop.com"]
 # 如果您在本地測試時，也可以加入 "http://localhost:8000"
 origins = ["https://kentware.com"] 
+# 一般回應的 CORS 標頭由 Flask-CORS 寫入；已註冊 API 路由的預檢請求由下方的 PreflightShortCircuit 直接回應
 CORS(app, resources={r"/api/*": {"origins": origins}})
 
+# 預檢回應的固定標頭；Max-Age 讓瀏覽器快取預檢結果，同一來源一天內只需預檢一次
+_CORS_HEADERS = (
+    ('Access-Control-Max-Age', '86400'),
+    ('Vary', 'Origin'),
+)
 
-# 從環境變數讀取您的露天 API 金鑰
-API_KEY = os.getenv('RUTEN_API_KEY')
-SECRET_KEY = os.getenv('RUTEN_SECRET_KEY')
-SALT_KEY = os.getenv('RUTEN_SALT_KEY')
+class PreflightShortCircuit:
+    """WSGI 中介層：允許來源對已註冊 API 路由的預檢請求直接回 204，不經過 Flask 的路由與 hook
 
-print("--- Ruten Proxy Service Starting (Production Mode) ---")
-print(f"Allowed Origins: {origins}")
-print(f"RUTEN_API_KEY loaded: {'Yes' if API_KEY else 'No - PLEASE CHECK RENDER ENV VARS'}")
+    非預檢的 OPTIONS（沒有 Access-Control-Request-Method）或不存在的路徑仍交給 Flask 處理。
+    """
 
+    def __init__(self, wsgi_app, allowed_origins, routes):
+        self.wsgi_app = wsgi_app
+        self.allowed_origins = frozenset(allowed_origins)
+        # {路徑: 允許的方法}，由 _preflight_routes() 從 app.url_map 產生
+        self.routes = routes
 
-BASE_URL = "https://partner.ruten.com.tw"
+    def __call__(self, environ, start_response):
+        origin = environ.get('HTTP_ORIGIN')
+        methods = self.routes.get(environ.get('PATH_INFO', ''))
+        if (
+            environ['REQUEST_METHOD'] == 'OPTIONS'
+            and methods is not None
+            and origin in self.allowed_origins
+            and environ.get('HTTP_ACCESS_CONTROL_REQUEST_METHOD')
+        ):
+            headers = [
+                ('Access-Control-Allow-Origin', origin),
+                ('Access-Control-Allow-Methods', methods),
+                *_CORS_HEADERS,
+            ]
+            request_headers = environ.get('HTTP_ACCESS_CONTROL_REQUEST_HEADERS')
+            if request_headers:
+                headers.append(('Access-Control-Allow-Headers', request_headers))
+            start_response('204 No Content', headers)
+            return [b'']
+        return self.wsgi_app(environ, start_response)
 
-def _make_ruten_request(endpoint: str, params: dict):
-    """一個通用的函數，用於準備並發送請求到露天"""
-    if not all([API_KEY, SECRET_KEY, SALT_KEY]):
-        raise ValueError("伺服器未設定露天 API 憑證")
 
-    sorted_params = dict(sorted(params.items()))
-    query_string = urlencode(sorted_params)
-    full_url = f"{BASE_URL}{endpoint}?{query_string}"
-    
-    timestamp = str(int(time.time()))
-    
-    request_body = ""
-    sign_string = f"{SALT_KEY}{full_url}{request_body}{timestamp}"
-    
-    signature = hmac.new(
-        SECRET_KEY.encode('utf-8'),
-        sign_string.encode('utf-8'),
-        hashlib.sha256
-    ).hexdigest()
-
-    headers = {
-        'User-Agent': 'Ruten-Proxy-App/1.0',
-        'Content-Type': 'application/json',
-        'X-RT-Key': API_KEY,
-        'X-RT-Timestamp': timestamp,
-        'X-RT-Authorization': signature
+def _preflight_routes(flask_app):
+    """從已註冊的路由產生 /api/* 路徑與允許方法的對照表，避免與 @app.route 的設定不同步"""
+    return {
+        rule.rule: ', '.join(sorted(rule.methods))
+        for rule in flask_app.url_map.iter_rules()
+        if rule.rule.startswith('/api/') and not rule.arguments
     }
-    
-    response = requests.get(full_url, headers=headers, timeout=20)
-    response.raise_for_status()
-    return response.json()
 
 
-@app.route('/api/ruten', methods=['GET', 'OPTIONS'])
-def ruten_proxy():
-    if request.method == 'OPTIONS':
-        return '', 200
+logger.info("--- Ruten Proxy Service Starting (Production Mode) ---")
+logger.info("Allowed Origins: %s", origins)
+logger.info("OpenSSL: %s", ssl.OPENSSL_VERSION)
+
+
+# 快取秒數：相同的查詢在這段時間內直接回傳，不再轉發給露天
+RESPONSE_CACHE_TTL = 30
+VERIFY_CACHE_TTL = 60
+
+# 批次查詢：單次最多轉發的請求數，以及同時進行的上游請求數
+BULK_MAX_ITEMS = 50
+_EXECUTOR = ThreadPoolExecutor(max_workers=8)
+
+# 對露天的單次請求逾時秒數與失敗重試次數
+UPSTREAM_TIMEOUT = 20
+UPSTREAM_RETRIES = 2
+# 合併請求時，其他請求等待第一個請求的上限（秒）。
+# 這只是上限而非最壞情況：requests 的 timeout 分別套用在連線與每次讀取上，
+# 加上重試，單一請求可能超過此時間；超過時等待方回傳 504，第一個請求仍會繼續完成
+COALESCE_WAIT = UPSTREAM_TIMEOUT * (UPSTREAM_RETRIES + 1) + 5
+
+# 共用連線池：重複使用與露天之間的 TCP/TLS 連線，避免每次請求都重新握手
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    # 同時請求超過 pool_maxsize 時排隊等待空出的連線，
+    # 而不是另開連線用完即丟（每次都要重新 TLS 握手）；與 gunicorn.conf.py 的 worker_connections 相關
+    pool_block=True,
+    max_retries=Retry(
+        total=UPSTREAM_RETRIES,
+        backoff_factor=0.2,
+        status_forcelist=[502, 503, 504],
+        # 重試用完後仍回傳最後一次的回應，讓露天的狀態碼與錯誤內容照常轉給前端
+        raise_on_status=False,
+    ),
+)
+SESSION.mount('https://', _adapter)
+SESSION.headers.update({
+    'User-Agent': 'Ruten-Proxy-App/1.0',
+    'Content-Type': 'application/json',
+})
+
+
+def _cache_key(endpoint: str, params: dict) -> tuple:
+    return endpoint, tuple(sorted(params.items()))
+
+
+def _ttl_cache(maxsize: int, ttl: float):
+    """簡易的 LRU + TTL 快取，只保存 2xx 的回應（錯誤狀態或發生例外時不會寫入）"""
+    def decorator(func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(endpoint: str, params: dict):
+            key = _cache_key(endpoint, params)
+            with lock:
+                entry = cache.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    cache.move_to_end(key)
+                    return entry[1]
+
+            result = func(endpoint, params)
+            if not 200 <= result[0] < 300:
+                return result
+
+            with lock:
+                cache[key] = (time.monotonic() + ttl, result)
+                cache.move_to_end(key)
+                while len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return result
+        return wrapper
+    return decorator
+
+
+@_ttl_cache(maxsize=1024, ttl=RESPONSE_CACHE_TTL)
+def _make_ruten_request(endpoint: str, params: dict) -> tuple:
+    """一個通用的函數，用於準備並發送請求到露天，回傳 (status_code, body bytes)"""
+    full_url, headers = build_signed_request(endpoint, params)
+    response = SESSION.get(full_url, headers=headers, timeout=UPSTREAM_TIMEOUT)
+    # 不論成功或失敗都直接回傳狀態碼與原始 JSON bytes，交給前端時不必再解析、重新序列化。
+    # 這裡刻意不使用 stream=True：完整的 body 要寫入快取，而 Response 會直接沿用
+    # 同一個 bytes 物件，記憶體中只會有一份資料。
+    return response.status_code, response.content
+
+
+# 進行中的上游請求，key 與快取相同；同一時間相同的查詢只會送出一次
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _make_ruten_request_coalesced(endpoint: str, params: dict) -> tuple:
+    """相同查詢同時進來時，只由第一個請求向露天取資料，其餘等待同一份結果"""
+    key = _cache_key(endpoint, params)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = _inflight[key] = Future()
+
+    if not is_leader:
+        return future.result(timeout=COALESCE_WAIT)
+
+    try:
+        result = _make_ruten_request(endpoint, params)
+    except BaseException as e:
+        # 包含 greenlet 被終止 (GreenletExit) 等情況，確保等待中的請求一定會被喚醒
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
 
+def _upstream_error_message(body: bytes) -> str:
+    """從露天回傳的錯誤內容中取出 error_msg"""
+    try:
+        return orjson.loads(body).get('error_msg', '露天 API 回傳了一個無法解析的錯誤')
+    except:
+        return '露天 API 回傳了一個無法解析的錯誤'
+
+
+def _is_json_body(body: bytes) -> bool:
+    """只看第一個非空白字元判斷是否為 JSON；空 body 或 HTML 錯誤頁都不算"""
+    return body.lstrip()[:1] in (b'{', b'[')
+
+
+def _fetch_or_error(endpoint: str, params: dict) -> bytes:
+    try:
+        status_code, body = _make_ruten_request(endpoint, params)
+        if not 200 <= status_code < 300:
+            message = _upstream_error_message(body)
+        elif _is_json_body(body):
+            return body
+        else:
+            # 空 body（如 204）或非 JSON 內容直接串進陣列會讓整批結果無法解析
+            message = '露天 API 回傳了非 JSON 的內容'
+    except Exception as e:
+        message = str(e)
+    logger.error("Bulk item failed (%s): %s", endpoint, message)
+    return orjson.dumps({"message": f"請求失敗: {message}"})
+
+
+def _make_ruten_request_many(pairs: list) -> list:
+    """以執行緒池並行送出多個 (endpoint, params) 請求，結果依輸入順序回傳"""
+    return list(_EXECUTOR.map(lambda p: _fetch_or_error(*p), pairs))
+
+
+@app.route('/api/ruten')
+def ruten_proxy():
     endpoint = request.args.get('endpoint')
     if not endpoint:
         return jsonify({"message": "錯誤：未提供目標 'endpoint' 參數"}), 400
+    if not is_valid_endpoint(endpoint):
+        return jsonify({"message": "錯誤：'endpoint' 必須是以 / 開頭的路徑"}), 400
 
     params = {k: v for k, v in request.args.items() if k != 'endpoint'}
     
-    if endpoint == '/api/v1/product/list':
+    if endpoint == PRODUCT_LIST_ENDPOINT:
         params.setdefault('status', 'all')
 
     try:
-        ruten_response = _make_ruten_request(endpoint, params)
-        return jsonify(ruten_response)
+        status_code, body = _make_ruten_request_coalesced(endpoint, params)
+    except FutureTimeoutError:
+        logger.error("Timed out waiting for in-flight request to %s", endpoint)
+        return jsonify({"message": "請求失敗: 等待露天 API 回應逾時"}), 504
     except Exception as e:
-        message = str(e)
-        status_code = 500
-        if isinstance(e, requests.exceptions.HTTPError):
-            status_code = e.response.status_code
-            try:
-                error_details = e.response.json()
-                message = error_details.get('error_msg', '露天 API 回傳了一個無法解析的錯誤')
-            except:
-                pass
-        print(f"[ERROR] An error occurred: {message}")
-        return jsonify({"message": f"請求失敗: {message}"}), status_code
-
-
-@app.route('/api/verify', methods=['GET', 'OPTIONS'])
+        logger.error("An error occurred: %s", e)
+        return jsonify({"message": f"請求失敗: {e}"}), 500
+
+    is_success = 200 <= status_code < 300
+    if not is_success:
+        logger.error("Ruten API returned %s for %s", status_code, endpoint)
+
+    if not _is_json_body(body):
+        # 閘道的 HTML 錯誤頁或空 body 不能標成 JSON 交給前端，改回傳一般的錯誤格式
+        if is_success:
+            return jsonify({"message": "請求失敗: 露天 API 回傳了非 JSON 的內容"}), 502
+        return jsonify({"message": "請求失敗: 露天 API 回傳了一個無法解析的錯誤"}), status_code
+
+    # 露天的 JSON 錯誤回應也原封不動地連同狀態碼轉給前端
+    response = Response(body, status=status_code, mimetype='application/json')
+    if is_success:
+        response.headers['Cache-Control'] = f'max-age={RESPONSE_CACHE_TTL}'
+    return response
+
+
+@app.route('/api/ruten_bulk', methods=['POST'])
+def ruten_bulk_proxy():
+    """一次轉發多個查詢，接收 [{"endpoint": ..., "params": {...}}, ...]，回傳對應順序的結果陣列"""
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not all(
+        isinstance(item, dict)
+        and is_valid_endpoint(item.get('endpoint'))
+        and isinstance(item.get('params', {}), dict)
+        for item in items
+    ):
+        return jsonify({"message": "錯誤：請提供 [{endpoint, params}] 格式的 JSON 陣列"}), 400
+    if len(items) > BULK_MAX_ITEMS:
+        return jsonify({"message": f"錯誤：單次最多 {BULK_MAX_ITEMS} 個請求"}), 400
+
+    pairs = []
+    for item in items:
+        endpoint = item['endpoint']
+        params = dict(item.get('params', {}))
+        if endpoint == PRODUCT_LIST_ENDPOINT:
+            params.setdefault('status', 'all')
+        pairs.append((endpoint, params))
+
+    # 每個結果本身都是 JSON，直接以 bytes 串成陣列，不必解析再序列化
+    bodies = _make_ruten_request_many(pairs)
+    return Response(b'[' + b','.join(bodies) + b']', mimetype='application/json')
+
+
+# 上次驗證成功後的有效期限（time.monotonic()），期限內不再重新驗證
+_verified_until = 0.0
+
+
+@app.route('/api/verify')
 def verify_credentials():
     """專門用來驗證憑證的端點"""
-    if request.method == 'OPTIONS':
-        return '', 200
-        
-    try:
-        _make_ruten_request('/api/v1/product/list', {'status': 'all', 'offset': 1, 'limit': 1})
+    global _verified_until
+    if time.monotonic() < _verified_until:
         return jsonify({"message": "憑證有效！與露天 API 通訊成功。", "valid": True})
+
+    try:
+        status_code, body = _make_ruten_request(
+            PRODUCT_LIST_ENDPOINT, {'status': 'all', 'offset': 1, 'limit': 1}
+        )
+        if 200 <= status_code < 300:
+            _verified_until = time.monotonic() + VERIFY_CACHE_TTL
+            return jsonify({"message": "憑證有效！與露天 API 通訊成功。", "valid": True})
+        message = _upstream_error_message(body)
     except Exception as e:
         message = str(e)
-        if isinstance(e, requests.exceptions.HTTPError):
-            try:
-                error_details = e.response.json()
-                message = error_details.get('error_msg', '露天 API 回傳了一個無法解析的錯誤')
-            except:
-                pass
-        print(f"[ERROR] Verification failed: {message}")
-        return jsonify({"message": f"憑證無效或請求失敗: {message}", "valid": False}), 401
+    logger.error("Verification failed: %s", message)
+    return jsonify({"message": f"憑證無效或請求失敗: {message}", "valid": False}), 401
 
 
 @app.route('/')
 def index():
     return "Ruten API Proxy is running (Production Mode)."
 
+
+# 必須在所有路由註冊完成後才安裝，預檢對照表才會包含每個 API 路由
+app.wsgi_app = PreflightShortCircuit(app.wsgi_app, origins, _preflight_routes(app))
+
 if __name__ == '__main__':
     # 這段是本地測試用的，部署到 Render 時不會執行
     # 若要在本地測試，請記得將您的 localhost 加入 origins 列表
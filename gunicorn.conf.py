@@ -0,0 +1,13 @@
+# Gunicorn 設定檔，gunicorn 啟動時會自動讀取工作目錄下的 gunicorn.conf.py
+# 啟動指令： gunicorn app:app
+
+# 使用 gevent worker，單一 worker 可同時等待多個露天 API 回應
+worker_class = 'gevent'
+workers = 2
+# 每個 worker 最多同時處理的請求數；其中需要轉發到露天的請求共用 app.py 中
+# SESSION 的連線池（pool_maxsize=50，pool_block=True），超過 50 個時會排隊等待可重複使用的連線
+worker_connections = 500
+
+# 前端反向代理（Render 或 NGINX）會重複使用與 gunicorn 的連線，
+# 預設 2 秒的 keep-alive 太短，連線很快就被關閉
+keepalive = 75
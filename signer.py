@@ -0,0 +1,74 @@
+"""露天 API 請求簽章
+
+每次轉發都會經過這裡組出 URL 與簽章標頭，屬於純 CPU 的熱路徑，
+因此獨立成一個只依賴標準函式庫、型別完整的模組，可用 mypyc 編譯成 C extension：
+
+    pip install mypy
+    mypyc signer.py
+
+編譯後產生的 .so 會優先於 signer.py 被 import，app.py 不需修改。
+注意：本模組在 import 時讀取金鑰，必須在 load_dotenv() 之後才 import。
+"""
+import hashlib
+import hmac
+import os
+import time
+from typing import Any, Dict, Tuple
+from urllib.parse import quote_plus
+
+BASE_URL = "https://partner.ruten.com.tw"
+PRODUCT_LIST_ENDPOINT = '/api/v1/product/list'
+_PRODUCT_LIST_KEYS = {'limit', 'offset', 'status'}
+
+# 從環境變數讀取您的露天 API 金鑰
+# 缺少任何一個都會直接拋出 KeyError 讓服務無法啟動，請檢查 Render 的環境變數設定
+API_KEY: str = os.environ['RUTEN_API_KEY']
+# 金鑰在程式執行期間不會改變，啟動時先轉成 bytes，避免每次請求重複編碼
+SECRET_KEY_BYTES: bytes = os.environ['RUTEN_SECRET_KEY'].encode('utf-8')
+SALT_KEY_BYTES: bytes = os.environ['RUTEN_SALT_KEY'].encode('utf-8')
+# 預先完成 HMAC 的金鑰設定，每次請求只需 copy() 後接續計算
+_HMAC_TEMPLATE = hmac.new(SECRET_KEY_BYTES, b'', hashlib.sha256)
+
+# 每次請求只需再填入時間戳與簽章的標頭樣板
+_PER_REQ_HEADERS: Dict[str, str] = {'X-RT-Key': API_KEY}
+
+
+def is_valid_endpoint(endpoint: Any) -> bool:
+    """endpoint 直接接在 BASE_URL 後面，必須是以 / 開頭的路徑；
+    否則像 "@evil.com/x" 會組出 https://partner.ruten.com.tw@evil.com/x，把簽章與金鑰送到其他主機"""
+    return isinstance(endpoint, str) and endpoint.startswith('/')
+
+
+def _build_query(endpoint: str, params: Dict[str, Any]) -> str:
+    """依參數名稱排序並組出 query string，結果與 urlencode(sorted(...)) 相同"""
+    if endpoint == PRODUCT_LIST_ENDPOINT and params.keys() == _PRODUCT_LIST_KEYS:
+        # 商品列表的固定參數組合，欄位順序已排序好，直接套用樣板
+        return (
+            f"limit={quote_plus(str(params['limit']))}"
+            f"&offset={quote_plus(str(params['offset']))}"
+            f"&status={quote_plus(str(params['status']))}"
+        )
+    return '&'.join(
+        f"{quote_plus(str(k))}={quote_plus(str(v))}" for k, v in sorted(params.items())
+    )
+
+
+def build_signed_request(endpoint: str, params: Dict[str, Any]) -> Tuple[str, Dict[str, str]]:
+    """組出完整 URL 與含簽章的標頭，回傳 (full_url, headers)"""
+    if not is_valid_endpoint(endpoint):
+        raise ValueError(f"endpoint 必須是以 / 開頭的路徑: {endpoint!r}")
+    query_string = _build_query(endpoint, params)
+    full_url = f"{BASE_URL}{endpoint}?{query_string}"
+
+    ts_bytes = b"%d" % (time.time_ns() // 1_000_000_000)
+
+    # 簽章字串為 Salt + URL + Request Body + Timestamp，GET 請求的 body 為空
+    sign_bytes = SALT_KEY_BYTES + full_url.encode('utf-8') + ts_bytes
+
+    h = _HMAC_TEMPLATE.copy()
+    h.update(sign_bytes)
+
+    headers = _PER_REQ_HEADERS.copy()
+    headers['X-RT-Timestamp'] = ts_bytes.decode('ascii')
+    headers['X-RT-Authorization'] = h.hexdigest()
+    return full_url, headers